@@ -10,7 +10,12 @@ import time
 import bcrypt
 import datetime
 import re
+import os
 import tempfile
+import threading
+from collections import Counter
+from model_router import ModelRouter, summarize_route_metrics
+from shared_state import open_shared_state, LeaseError
 
 # --- ΡΥΘΜΙΣΕΙΣ ΣΕΛΙΔΑΣ ---
 st.set_page_config(page_title="CF Capital Fresh | Ultimate HVAC", page_icon="❄️", layout="wide")
@@ -50,11 +55,25 @@ st.markdown("""<style>
 INDEX_FILE_NAME = "hvac_master_index_v10.json"
 USERS_FILE_NAME = "hvac_users.json"
 LOGS_FILE_NAME = "hvac_logs.json"
+LOG_STREAM = "activity_logs" # Append-only logs στο shared backend πριν το compact στο Drive
+LOG_COMPACT_EVERY = 100
+ROUTING_METRICS_FILE = "hvac_routing_metrics.jsonl"
+BUSY_MSG = "⏳ Άλλη εγγραφή είναι σε εξέλιξη, δοκιμάστε ξανά σε λίγο."
+CHAT_HISTORY_WINDOW = 20 # Πόσα μηνύματα ζωγραφίζονται σε κάθε rerun
+WARM_MAX_MANUALS = 5 # Warm working set: μέγιστα manuals ανά τεχνικό
+WARM_BYTE_BUDGET = 80 * 1024 * 1024 # ...και μέγιστα bytes ανά τεχνικό
+WARM_GLOBAL_BYTE_BUDGET = 400 * 1024 * 1024 # Manuals εκτός warm sets (π.χ. από chat miss) ανά process
+WARM_MAX_USERS = 20 # Warm sets ανά process: κρατιούνται οι πιο πρόσφατοι τεχνικοί...
+WARM_SET_TTL = 12 * 3600 # ...και μόνο για όσο διαρκεί μια βάρδια
+GEMINI_FILE_TTL = 46 * 3600 # Τα uploads του Gemini λήγουν στις 48h
 
 # --- 1. SETUP GOOGLE SERVICES ---
 auth_status = "⏳ Connecting..."
 drive_service = None
+drive_creds = None # Για ξεχωριστό Drive client στα background threads
 CURRENT_MODEL_NAME = "gemini-1.5-flash" # Default fallback
+MODEL_TIERS = {"fast": "gemini-1.5-flash", "strong": "gemini-1.5-pro"} # Router tiers (defaults)
+ROUTER = ModelRouter(MODEL_TIERS, ["🔥 Καυστήρες"], ROUTING_METRICS_FILE)
 
 try:
     # A. Gemini Setup
@@ -68,6 +87,10 @@ try:
                 if wanted in all_models:
                     CURRENT_MODEL_NAME = wanted
                     break
+            tier_priority = {"fast": ["gemini-2.0-flash-exp", "gemini-1.5-flash"], "strong": ["gemini-1.5-pro", "gemini-2.0-flash-exp"]}
+            for tier, wanted_list in tier_priority.items():
+                found = next((m for m in wanted_list if m in all_models), None)
+                if found: MODEL_TIERS[tier] = found
         except: pass
 
     # B. Drive Setup
@@ -80,21 +103,25 @@ try:
             info, scopes=['https://www.googleapis.com/auth/drive']
         )
         drive_service = build('drive', 'v3', credentials=creds)
+        drive_creds = creds
         auth_status = "✅ Online"
 except Exception as e:
     auth_status = f"⚠️ Error: {str(e)}"
 
 # --- 2. DRIVE FUNCTIONS (Safe & Smart) ---
 
-def load_json_from_drive(filename):
-    """Φόρτωση αρχείων JSON με ασφάλεια"""
-    if not drive_service: return None
+def load_json_from_drive(filename, service=None, strict=False):
+    """Φόρτωση αρχείων JSON με ασφάλεια (strict: σφάλμα Drive -> exception αντί για None)"""
+    service = service or drive_service
+    if not service:
+        if strict: raise RuntimeError("Drive offline")
+        return None
     try:
-        results = drive_service.files().list(q=f"name = '{filename}' and trashed = false", fields="files(id)").execute()
+        results = service.files().list(q=f"name = '{filename}' and trashed = false", fields="files(id)").execute()
         files = results.get('files', [])
         if files:
             file_id = files[0]['id']
-            request = drive_service.files().get_media(fileId=file_id)
+            request = service.files().get_media(fileId=file_id)
             fh = io.BytesIO()
             downloader = MediaIoBaseDownload(fh, request)
             done = False
@@ -102,12 +129,13 @@ def load_json_from_drive(filename):
             content = fh.getvalue().decode('utf-8')
             if not content: return None
             return json.loads(content)
-    except: pass
+    except:
+        if strict: raise
     return None
 
 def save_json_to_drive(filename, data):
-    """Αποθήκευση JSON πίσω στο Drive"""
-    if not drive_service: return
+    """Αποθήκευση JSON πίσω στο Drive -> True/False"""
+    if not drive_service: return False
     try:
         results = drive_service.files().list(q=f"name = '{filename}' and trashed = false").execute()
         files = results.get('files', [])
@@ -117,8 +145,10 @@ def save_json_to_drive(filename, data):
         else:
             file_metadata = {'name': filename, 'mimeType': 'application/json'}
             drive_service.files().create(body=file_metadata, media_body=media).execute()
+        return True
     except Exception as e:
         st.error(f"Save Error: {e}")
+        return False
 
 def get_all_pdf_files():
     """Φέρνει όλα τα PDF/Εικόνες από το Drive για το Sync"""
@@ -139,9 +169,9 @@ def get_all_pdf_files():
         return all_files
     except: return []
 
-def download_temp_for_ai(file_id, file_name):
+def download_temp_for_ai(file_id, file_name, service=None):
     """Κατεβάζει προσωρινά για AI Analysis"""
-    req = drive_service.files().get_media(fileId=file_id)
+    req = (service or drive_service).files().get_media(fileId=file_id)
     fh = io.BytesIO()
     downloader = MediaIoBaseDownload(fh, req)
     done = False
@@ -183,20 +213,176 @@ def check_password(password, hashed):
     except: return False
 
 def log_activity(email, action, detail):
-    logs = load_json_from_drive(LOGS_FILE_NAME) or []
     entry = {
         "timestamp": datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
         "user": email,
         "action": action,
         "detail": detail
     }
-    logs.append(entry)
-    save_json_to_drive(LOGS_FILE_NAME, logs)
+    # Append-only στο shared backend (χωρίς lease/Drive ανά chat turn), compact ανά LOG_COMPACT_EVERY
+    try:
+        if SHARED.append_record(LOG_STREAM, entry) % LOG_COMPACT_EVERY == 0: compact_activity_logs()
+    except Exception as e: print(f"Log skipped: {e}")
+
+def compact_activity_logs():
+    """Μεταφέρει τα εκκρεμή logs στο Drive αρχείο (ένα replica τη φορά, non-blocking)"""
+    return SHARED.compact(LOG_STREAM, lambda: load_json_from_drive(LOGS_FILE_NAME, strict=True),
+                          lambda data: save_json_to_drive(LOGS_FILE_NAME, data))
+
+def load_activity_logs(service=None):
+    """Drive logs + όσα δεν έχουν γίνει ακόμα compact"""
+    return (load_json_from_drive(LOGS_FILE_NAME, service) or []) + SHARED.records(LOG_STREAM)
+
+# --- WARM WORKING SET (προφόρτωση manuals ανά τεχνικό στο login) ---
+
+@st.cache_resource
+def get_manual_cache():
+    """Κοινό ανά process: local αρχεία + Gemini uploads, warm sets, hit/miss ανά χρήστη
+    και τα manuals που κατεβαίνουν/ανεβαίνουν αυτή τη στιγμή (in-flight, δεν σβήνονται)"""
+    return {"files": {}, "users": {}, "stats": {}, "fetching": {}, "lock": threading.Lock()}
+
+def manual_label(data):
+    """Το ίδιο κείμενο που γράφεται στο detail των SEARCH_HIT logs"""
+    return f"{data.get('model_info')} ({data['name']})"
+
+def rank_user_manuals(logs, email, index):
+    """Τα manuals του χρήστη κατά συχνότητα, από τα SEARCH_HIT του ιστορικού"""
+    by_label = {manual_label(data): fid for fid, data in index.items()}
+    counts = Counter(by_label[l["detail"]] for l in logs
+                     if l.get("user") == email and l.get("action") == "SEARCH_HIT" and l.get("detail") in by_label)
+    return [fid for fid, _ in counts.most_common()]
+
+def fetch_manual(cache, fid, name, service):
+    """Local αρχείο + Gemini upload για ένα manual, από το cache αν είναι ακόμα έγκυρο.
+    Single-flight: αν το ίδιο manual κατεβαίνει ήδη (chat ή warm-up), περιμένουμε εκείνο."""
+    with cache["lock"]:
+        entry = cache["files"].get(fid)
+        if entry and time.time() - entry["uploaded_at"] < GEMINI_FILE_TTL:
+            entry["last_used"] = time.time()
+            return entry
+        flight = cache["fetching"].get(fid)
+        leader = flight is None
+        if leader: # Όσο ανεβαίνει, το evict_manuals δεν το αγγίζει
+            flight = cache["fetching"][fid] = {"done": threading.Event(), "entry": None, "error": None}
+            path = entry["path"] if entry else None
+    if not leader:
+        flight["done"].wait()
+        if flight["error"]: raise flight["error"]
+        return flight["entry"]
+    try:
+        if not path or not os.path.exists(path): path = download_temp_for_ai(fid, name, service)
+        gfile = genai.upload_file(path)
+        while gfile.state.name == "PROCESSING":
+            time.sleep(1)
+            gfile = genai.get_file(gfile.name)
+        entry = {"path": path, "size": os.path.getsize(path), "gfile": gfile, "uploaded_at": time.time(), "last_used": time.time()}
+        with cache["lock"]: cache["files"][fid] = entry
+        flight["entry"] = entry
+    except Exception as e:
+        flight["error"] = e
+        raise
+    finally:
+        with cache["lock"]: del cache["fetching"][fid]
+        flight["done"].set()
+    evict_manuals(cache)
+    return entry
+
+def evict_manuals(cache):
+    """Τα warm sets και ό,τι κατεβαίνει τώρα μένουν πάντα. Τα υπόλοιπα local αρχεία (π.χ. από
+    chat miss) κρατιούνται LRU μέσα στο δικό τους WARM_GLOBAL_BYTE_BUDGET. Σβήνεται μόνο το local
+    αρχείο: το Gemini upload μένει στο cache όσο είναι έγκυρο (GEMINI_FILE_TTL)."""
+    with cache["lock"]:
+        now = time.time()
+        # Warm sets: λήξη μετά από WARM_SET_TTL και το πολύ WARM_MAX_USERS (τα πιο πρόσφατα)
+        recent = sorted(cache["users"].items(), key=lambda kv: kv[1]["at"], reverse=True)
+        cache["users"] = {email: w for email, w in recent[:WARM_MAX_USERS] if now - w["at"] < WARM_SET_TTL}
+
+        keep = {fid for w in cache["users"].values() for fid in w["fids"]} | set(cache["fetching"])
+        used = 0
+        others = sorted((fid for fid, e in cache["files"].items() if fid not in keep and e["path"]),
+                        key=lambda fid: cache["files"][fid]["last_used"], reverse=True)
+        for fid in others:
+            entry = cache["files"][fid]
+            if used + entry["size"] <= WARM_GLOBAL_BYTE_BUDGET:
+                used += entry["size"]
+                continue
+            try: os.remove(entry["path"])
+            except OSError: pass
+            entry["path"] = None
+        # Χωρίς local αρχείο και με ληγμένο upload δεν έχει πια αξία
+        for fid in [fid for fid, e in cache["files"].items()
+                    if not e["path"] and now - e["uploaded_at"] >= GEMINI_FILE_TTL and fid not in keep]:
+            del cache["files"][fid]
+
+def drop_warm_set(email):
+    """Logout: τα manuals του τεχνικού γίνονται απλά LRU (όχι άμεση διαγραφή)"""
+    cache = get_manual_cache()
+    with cache["lock"]: cache["users"].pop(email, None)
+    evict_manuals(cache)
+
+def warm_user_manuals(cache, email, index):
+    """Background thread: προφορτώνει τα πιο συχνά manuals του χρήστη μέσα στο budget του.
+    Το cache έρχεται από το start_warmup: εδώ δεν υπάρχει ScriptRunContext για st.cache_resource."""
+    try:
+        service = build('drive', 'v3', credentials=drive_creds) # Ο httplib2 client δεν είναι thread-safe
+        logs = load_activity_logs(service)
+        chosen, used = [], 0
+        for fid in rank_user_manuals(logs, email, index):
+            if len(chosen) >= WARM_MAX_MANUALS: break
+            try:
+                size = int(service.files().get(fileId=fid, fields="size").execute().get("size", 0))
+                if used + size > WARM_BYTE_BUDGET: continue
+                fetch_manual(cache, fid, index[fid]["name"], service)
+            except Exception as e:
+                print(f"Warm-up error on {fid}: {e}"); continue
+            chosen.append(fid); used += size
+        with cache["lock"]: cache["users"][email] = {"fids": chosen, "at": time.time()}
+        evict_manuals(cache)
+    except Exception as e:
+        print(f"Warm-up failed for {email}: {e}")
+
+def start_warmup(email):
+    if not drive_creds: return
+    threading.Thread(target=warm_user_manuals, args=(get_manual_cache(), email, dict(st.session_state.master_index)), daemon=True).start()
+
+def manual_for_context(email, fid, name):
+    """Entry του manual για το prompt (gfile + size): από το cache (hit) ή κατέβασμα+upload (miss)"""
+    cache = get_manual_cache()
+    with cache["lock"]:
+        entry = cache["files"].get(fid)
+        hit = bool(entry) and time.time() - entry["uploaded_at"] < GEMINI_FILE_TTL
+        stats = cache["stats"].setdefault(email, {"hits": 0, "misses": 0})
+        stats["hits" if hit else "misses"] += 1
+    try: return fetch_manual(cache, fid, name, drive_service)
+    except Exception as e:
+        print(f"Manual context error on {fid}: {e}")
+        return None
+
 # --- 4. STATE MANAGEMENT ---
 
+@st.cache_resource
+def get_shared_state():
+    """Ένα backend ανά process: leases + change feed μεταξύ replicas (βλ. shared_state.py)"""
+    return open_shared_state(st.secrets["SHARED_STATE_URL"] if "SHARED_STATE_URL" in st.secrets else None)
+
+SHARED = get_shared_state()
+
+def load_master_index():
+    """Πλήρες load από Drive. Το baseline του change feed κρατιέται ΠΡΙΝ το load,
+    ώστε ό,τι γραφτεί στο μεταξύ να ξαναεφαρμοστεί (idempotent)."""
+    st.session_state.index_change_id = SHARED.last_change_id()
+    st.session_state.master_index = load_json_from_drive(INDEX_FILE_NAME) or {}
+
+def sync_index_changes():
+    """Εφαρμόζει στο in-memory index τις αλλαγές των άλλων replicas χωρίς reload του Drive"""
+    changes, last_id = SHARED.changes_since("index", st.session_state.index_change_id)
+    if changes is None: return load_master_index() # Πολύ παλιό baseline
+    for c in changes: st.session_state.master_index[c["key"]] = c["value"]
+    st.session_state.index_change_id = last_id
+
 # Φόρτωση Index/Users με προστασία (or {})
 if "master_index" not in st.session_state:
-    st.session_state.master_index = load_json_from_drive(INDEX_FILE_NAME) or {}
+    load_master_index()
 
 if "users_db" not in st.session_state:
     st.session_state.users_db = load_json_from_drive(USERS_FILE_NAME) or {}
@@ -225,6 +411,7 @@ def login_page():
                     st.session_state.user_info = users[email]
                     st.session_state.user_info['email'] = email
                     log_activity(email, "LOGIN", "Success")
+                    start_warmup(email)
                     st.rerun()
                 else: st.warning("Ο λογαριασμός είναι υπό έγκριση ή ανενεργός.")
             else: st.error("Λάθος στοιχεία.")
@@ -234,117 +421,189 @@ def login_page():
         new_email = st.text_input("Email Εγγραφής").lower().strip()
         new_pass = st.text_input("Κωδικός (min 8 chars, γράμματα & αριθμοί)", type="password")
         if st.button("Εγγραφή"):
-            users = load_json_from_drive(USERS_FILE_NAME) or {}
-            # Password validation logic could go here
-            if new_email not in users:
-                users[new_email] = {
-                    "name": "New User", 
-                    "password": hash_password(new_pass), 
-                    "role": "user", 
-                    "status": "pending", 
-                    "joined": str(datetime.date.today())
-                }
-                save_json_to_drive(USERS_FILE_NAME, users)
-                st.success("Εγγραφή επιτυχής! Περιμένετε έγκριση.")
-            else:
-                st.error("Το email υπάρχει ήδη.")
-
-def main_app():
-    user = st.session_state.user_info
+            try:
+                with SHARED.lease("users") as lease:
+                    users = load_json_from_drive(USERS_FILE_NAME) or {}
+                    # Password validation logic could go here
+                    created = new_email not in users
+                    if created:
+                        users[new_email] = {
+                            "name": "New User", 
+                            "password": hash_password(new_pass), 
+                            "role": "user", 
+                            "status": "pending", 
+                            "joined": str(datetime.date.today())
+                        }
+                        lease.check()
+                        save_json_to_drive(USERS_FILE_NAME, users)
+                if created: st.success("Εγγραφή επιτυχής! Περιμένετε έγκριση.")
+                else: st.error("Το email υπάρχει ήδη.")
+            except LeaseError: st.error(BUSY_MSG)
+
+# --- 5. ADMIN FRAGMENTS (τρέχουν ανεξάρτητα, φορτώνουν δεδομένα μόνο όταν εμφανίζονται) ---
+
+ADMIN_CLOSED = "➖ Κλειστό"
+
+@st.fragment
+def admin_users_fragment():
+    """Χρήστες σε αναμονή - διαβάζει από Drive μόνο όταν ανοίξει το panel"""
+    if st.button("🔄 Ανανέωση", key="refresh_users"): st.session_state.pop("admin_users_cache", None)
+    if "admin_users_cache" not in st.session_state:
+        st.session_state.admin_users_cache = load_json_from_drive(USERS_FILE_NAME) or {}
+    users = st.session_state.admin_users_cache
+
+    pending_count = 0
+    for email, data in users.items():
+        if data.get('status') == 'pending':
+            pending_count += 1
+            c_a, c_b = st.columns(2)
+            c_a.write(f"⚠️ **{data.get('name')}** ({email})")
+            if c_b.button("✅ Έγκριση", key=email):
+                # Φρέσκο διάβασμα κάτω από lease για να μη χαθούν εγγραφές άλλων replicas
+                try:
+                    with SHARED.lease("users") as lease:
+                        fresh = load_json_from_drive(USERS_FILE_NAME) or {}
+                        if email in fresh:
+                            fresh[email]['status'] = 'active'
+                            lease.check()
+                            save_json_to_drive(USERS_FILE_NAME, fresh)
+                except LeaseError:
+                    st.error(BUSY_MSG)
+                else:
+                    st.session_state.admin_users_cache = fresh
+                    st.rerun(scope="fragment")
+    if pending_count == 0: st.success("Κανένας χρήστης σε αναμονή.")
+
+@st.fragment
+def admin_logs_fragment():
+    """Logs - διαβάζονται μία φορά και ξανά μόνο με Refresh"""
+    if st.button("Refresh Logs"): st.session_state.pop("admin_logs_cache", None)
+    if "admin_logs_cache" not in st.session_state:
+        compact_activity_logs()
+        st.session_state.admin_logs_cache = load_activity_logs()
+    st.dataframe(st.session_state.admin_logs_cache)
+
+@st.fragment
+def admin_routing_fragment():
+    """Latency/κόστος ανά tier του router - για ρύθμιση των ROUTE_* thresholds"""
+    if st.button("Refresh Routing"): pass
+    metrics = ROUTER.load_metrics()
+    if not metrics:
+        st.info("Δεν υπάρχουν ακόμα μετρήσεις routing.")
+        return
+    st.dataframe(summarize_route_metrics(metrics))
+    st.caption(f"Τελευταίες κλήσεις ({min(len(metrics), 50)} από {len(metrics)})")
+    st.dataframe(metrics[-50:])
+
+@st.fragment
+def admin_warm_cache_fragment():
+    """Hit rate του warm working set ανά τεχνικό (μετρήσεις αυτού του replica)"""
+    if st.button("Refresh Warm Cache"): pass
+    cache = get_manual_cache()
+    with cache["lock"]:
+        sizes = {fid: e["size"] for fid, e in cache["files"].items()}
+        users = {email: list(w["fids"]) for email, w in cache["users"].items()}
+        on_disk = sum(e["size"] for e in cache["files"].values() if e["path"])
+        stats = {email: dict(s) for email, s in cache["stats"].items()}
+    rows = []
+    for email in sorted(set(users) | set(stats)):
+        s = stats.get(email, {"hits": 0, "misses": 0})
+        total = s["hits"] + s["misses"]
+        rows.append({
+            "user": email,
+            "warm_manuals": len(users.get(email, [])),
+            "warm_mb": round(sum(sizes.get(fid, 0) for fid in users.get(email, [])) / 1024 / 1024, 1),
+            "hits": s["hits"], "misses": s["misses"],
+            "hit_rate": f"{s['hits'] / total:.0%}" if total else "-",
+        })
+    hits = sum(r["hits"] for r in rows); total = hits + sum(r["misses"] for r in rows)
+    st.metric("Συνολικό Hit Rate", f"{hits / total:.0%}" if total else "-")
+    st.caption(f"Cache: {len(sizes)} manuals, {on_disk / 1024 / 1024:.1f} MB στο δίσκο | Budget ανά τεχνικό: {WARM_MAX_MANUALS} manuals / {WARM_BYTE_BUDGET // 1024 // 1024} MB | Εκτός warm sets: {WARM_GLOBAL_BYTE_BUDGET // 1024 // 1024} MB")
+    if rows: st.dataframe(rows)
+    else: st.info("Δεν υπάρχουν ακόμα δεδομένα warm cache.")
+
+@st.fragment
+def admin_sync_fragment():
+    st.write("#### 📡 Έλεγχος Βάσης Δεδομένων")
     
-    # Header Info
-    c1, c2 = st.columns([3,1])
-    with c1: st.caption(f"👤 {user.get('name')} | 🤖 Brain: {CURRENT_MODEL_NAME}")
-    with c2: 
-        if st.button("Logout"): 
-            st.session_state.user_info = None; st.rerun()
-
-    # --- ADMIN DASHBOARD ---
-    if user.get('role') == 'admin':
-        with st.expander("👑 Διαχείριση & Sync", expanded=False):
-            tab_users, tab_logs, tab_sync = st.tabs(["Χρήστες", "Logs", "🔄 Smart Sync"])
+    # Κουμπί 1: Σάρωση
+    if st.button("🔍 1. Σάρωση Drive για νέα αρχεία"):
+        with st.spinner("Γίνεται καταγραφή αρχείων..."):
+            drive_files = get_all_pdf_files()
+            st.session_state.drive_snapshot = drive_files
             
-            with tab_users:
-                users = load_json_from_drive(USERS_FILE_NAME) or {}
-                pending_count = 0
-                for email, data in users.items():
-                    if data.get('status') == 'pending':
-                        pending_count += 1
-                        c_a, c_b = st.columns(2)
-                        c_a.write(f"⚠️ **{data.get('name')}** ({email})")
-                        if c_b.button("✅ Έγκριση", key=email):
-                            users[email]['status'] = 'active'
-                            save_json_to_drive(USERS_FILE_NAME, users)
-                            st.rerun()
-                if pending_count == 0: st.success("Κανένας χρήστης σε αναμονή.")
+            # Compare with Index
+            load_master_index()
+            index = st.session_state.master_index
             
-            with tab_logs:
-                if st.button("Refresh Logs"): pass
-                st.dataframe(load_json_from_drive(LOGS_FILE_NAME) or [])
+            drive_ids = {f['id']: f['name'] for f in drive_files}
+            indexed_ids = set(index.keys())
+            
+            st.session_state.new_files_ids = list(set(drive_ids.keys()) - indexed_ids)
+            st.success(f"Drive: {len(drive_ids)} | Index: {len(indexed_ids)} | 🆕 Νέα: {len(st.session_state.new_files_ids)}")
 
-            with tab_sync:
-                st.write("#### 📡 Έλεγχος Βάσης Δεδομένων")
+    # Κουμπί 2: Μαζική Επεξεργασία (Batch Process)
+    if "new_files_ids" in st.session_state and st.session_state.new_files_ids:
+        count_new = len(st.session_state.new_files_ids)
+        st.info(f"Έχουν εντοπιστεί {count_new} νέα manuals.")
+        
+        if st.button(f"🚀 2. Έναρξη Αυτόματου Συγχρονισμού ({count_new} αρχεία)"):
+            progress_bar = st.progress(0)
+            status_text = st.empty()
+            
+            # Loop processing
+            for i, fid in enumerate(st.session_state.new_files_ids):
+                # Find name
+                fname = next((f['name'] for f in st.session_state.drive_snapshot if f['id'] == fid), "Unknown")
                 
-                # Κουμπί 1: Σάρωση
-                if st.button("🔍 1. Σάρωση Drive για νέα αρχεία"):
-                    with st.spinner("Γίνεται καταγραφή αρχείων..."):
-                        drive_files = get_all_pdf_files()
-                        st.session_state.drive_snapshot = drive_files
-                        
-                        # Compare with Index
-                        index = load_json_from_drive(INDEX_FILE_NAME) or {}
-                        st.session_state.master_index = index
-                        
-                        drive_ids = {f['id']: f['name'] for f in drive_files}
-                        indexed_ids = set(index.keys())
-                        
-                        st.session_state.new_files_ids = list(set(drive_ids.keys()) - indexed_ids)
-                        st.success(f"Drive: {len(drive_ids)} | Index: {len(indexed_ids)} | 🆕 Νέα: {len(st.session_state.new_files_ids)}")
-
-                # Κουμπί 2: Μαζική Επεξεργασία (Batch Process)
-                if "new_files_ids" in st.session_state and st.session_state.new_files_ids:
-                    count_new = len(st.session_state.new_files_ids)
-                    st.info(f"Έχουν εντοπιστεί {count_new} νέα manuals.")
-                    
-                    if st.button(f"🚀 2. Έναρξη Αυτόματου Συγχρονισμού ({count_new} αρχεία)"):
-                        progress_bar = st.progress(0)
-                        status_text = st.empty()
-                        
-                        # Loop processing
-                        for i, fid in enumerate(st.session_state.new_files_ids):
-                            # Find name
-                            fname = next((f['name'] for f in st.session_state.drive_snapshot if f['id'] == fid), "Unknown")
-                            
-                            # UI Update
-                            progress = (i + 1) / count_new
-                            progress_bar.progress(progress)
-                            status_text.text(f"🔄 ({i+1}/{count_new}) Ανάλυση: {fname} ...")
-                            
-                            # AI Action
-                            try:
-                                path = download_temp_for_ai(fid, fname)
-                                info = identify_model_deep_scan(path)
-                                st.session_state.master_index[fid] = {"name": fname, "model_info": info}
-                                # Save every 1 file for safety
-                                save_json_to_drive(INDEX_FILE_NAME, st.session_state.master_index)
-                            except Exception as e:
-                                print(f"Error on {fname}: {e}")
-                        
-                        status_text.success("✅ Ο Συγχρονισμός Ολοκληρώθηκε!")
-                        st.balloons()
-                        # Clear processed list
-                        st.session_state.new_files_ids = []
+                # UI Update
+                progress = (i + 1) / count_new
+                progress_bar.progress(progress)
+                status_text.text(f"🔄 ({i+1}/{count_new}) Ανάλυση: {fname} ...")
+                
+                # AI Action
+                try:
+                    path = download_temp_for_ai(fid, fname)
+                    info = identify_model_deep_scan(path)
+                    entry = {"name": fname, "model_info": info}
+                    # Save every 1 file for safety - κάτω από lease, με τις αλλαγές των άλλων replicas
+                    with SHARED.lease("index") as lease:
+                        sync_index_changes()
+                        st.session_state.master_index[fid] = entry
+                        lease.check()
+                        save_json_to_drive(INDEX_FILE_NAME, st.session_state.master_index)
+                        SHARED.publish("index", fid, entry)
+                except Exception as e:
+                    print(f"Error on {fname}: {e}")
+            
+            status_text.success("✅ Ο Συγχρονισμός Ολοκληρώθηκε!")
+            st.balloons()
+            # Clear processed list
+            st.session_state.new_files_ids = []
+
+# --- 6. CHAT FRAGMENT ---
+
+def render_chat_history(messages):
+    """Windowed rendering: μόνο τα τελευταία chat_window μηνύματα σε κάθε rerun.
+    Τα παλαιότερα ανοίγουν ανά CHAT_HISTORY_WINDOW και το παράθυρο μηδενίζει σε κάθε νέο μήνυμα."""
+    window = st.session_state.get("chat_window", CHAT_HISTORY_WINDOW)
+    hidden = max(0, len(messages) - window)
+    if hidden and st.button(f"⬆️ Εμφάνιση {min(hidden, CHAT_HISTORY_WINDOW)} παλαιότερων μηνυμάτων (από {hidden})"):
+        st.session_state.chat_window = window + CHAT_HISTORY_WINDOW
+        st.rerun(scope="fragment")
+    for m in messages[hidden:]:
+        with st.chat_message(m["role"]): st.markdown(m["content"], unsafe_allow_html=True)
 
-    # --- CHAT INTERFACE ---
-    st.divider()
+@st.fragment
+def chat_fragment(user):
     tech_mode = st.radio("Ειδικότητα:", ["❄️ Κλιματισμός", "🧊 Ψύξη", "🔥 Καυστήρες"], horizontal=True)
 
     if "messages" not in st.session_state: st.session_state.messages = []
     
-    for m in st.session_state.messages: 
-        with st.chat_message(m["role"]): st.markdown(m["content"], unsafe_allow_html=True)
+    render_chat_history(st.session_state.messages)
 
     if prompt := st.chat_input("Περιγραφή βλάβης ή κωδικός..."):
+        st.session_state.chat_window = CHAT_HISTORY_WINDOW
         # User Message
         st.session_state.messages.append({"role": "user", "content": prompt})
         st.chat_message("user").markdown(prompt)
@@ -352,24 +611,28 @@ def main_app():
         with st.chat_message("assistant"):
             # 1. Search Manual
             found_manual_txt = None
-            if "master_index" not in st.session_state: st.session_state.master_index = load_json_from_drive(INDEX_FILE_NAME) or {}
+            manual_file = None
+            manual_bytes = 0
+            if "master_index" not in st.session_state: load_master_index()
+            else: sync_index_changes()
             
             # Smart Search
             matches = []
             for fid, data in st.session_state.master_index.items():
                 full_search = (data['name'] + " " + data.get('model_info', '')).lower()
                 if prompt.lower() in full_search:
-                    matches.append(data)
+                    matches.append((fid, data))
             
             # Αν βρεθεί manual
             if matches:
-                data = matches[0]
-                found_manual_txt = f"{data.get('model_info')} ({data['name']})"
+                fid, data = matches[0]
+                found_manual_txt = manual_label(data)
                 log_activity(user['email'], "SEARCH_HIT", found_manual_txt)
                 
-                # Κατέβασμα για Context
-                # (Εδώ απλά το δηλώνουμε στο prompt για οικονομία χρόνου, 
-                # σε full version θα κατέβαινε και το αρχείο για RAG)
+                # Κατέβασμα για Context (συνήθως ήδη στο warm cache από το login)
+                with st.spinner("📥 Φόρτωση manual..."):
+                    manual_entry = manual_for_context(user['email'], fid, data['name'])
+                if manual_entry: manual_file, manual_bytes = manual_entry["gfile"], manual_entry["size"]
                 
                 display_html = f"""
                 <div class="manual-box">
@@ -387,7 +650,7 @@ def main_app():
 
             # 2. AI Generation (Hybrid)
             try:
-                model = genai.GenerativeModel(CURRENT_MODEL_NAME)
+                tier = ROUTER.route(prompt, tech_mode=tech_mode, manual_found=bool(found_manual_txt), attachment_bytes=manual_bytes)
                 
                 full_prompt = f"""
                 Είσαι έμπειρος τεχνικός {tech_mode}.
@@ -402,12 +665,12 @@ def main_app():
                 """
                 
                 with st.spinner("🧠 Ανάλυση..."):
-                    resp = model.generate_content(full_prompt)
+                    answer, used_model, _ = ROUTER.generate([full_prompt] + ([manual_file] if manual_file else []), tier, len(prompt), manual_bytes)
                     
                     final_html = f"""
                     <div class="ai-box">
-                        <b>🤖 Απάντηση AI:</b><br>
-                        {resp.text}
+                        <b>🤖 Απάντηση AI</b> <small>({used_model})</small>:<br>
+                        {answer or "⚠️ Δεν δόθηκε απάντηση από το AI."}
                     </div>
                     """
                     st.markdown(final_html, unsafe_allow_html=True)
@@ -416,6 +679,38 @@ def main_app():
             except Exception as e:
                 st.error(f"AI Error: {e}")
 
+def main_app():
+    user = st.session_state.user_info
+    
+    # Header Info
+    c1, c2 = st.columns([3,1])
+    with c1: st.caption(f"👤 {user.get('name')} | 🤖 Brain: {MODEL_TIERS['fast']} → {MODEL_TIERS['strong']}")
+    with c2: 
+        if st.button("Logout"): 
+            drop_warm_set(user.get('email'))
+            st.session_state.user_info = None; st.rerun()
+
+    # --- ADMIN DASHBOARD ---
+    # Radio αντί για expander: το σώμα του expander εκτελείται σε κάθε rerun ακόμα και κλειστό,
+    # εδώ κάθε panel (fragment) τρέχει/φορτώνει μόνο όταν είναι επιλεγμένο.
+    if user.get('role') == 'admin':
+        admin_view = st.radio("👑 Διαχείριση & Sync", [ADMIN_CLOSED, "Χρήστες", "Logs", "🔄 Smart Sync", "📈 Routing", "🔥 Warm Cache"], horizontal=True, key="admin_view")
+        if admin_view == ADMIN_CLOSED:
+            # Στο επόμενο άνοιγμα φέρνουμε φρέσκα δεδομένα
+            st.session_state.pop("admin_users_cache", None)
+            st.session_state.pop("admin_logs_cache", None)
+        else:
+            with st.container(border=True):
+                if admin_view == "Χρήστες": admin_users_fragment()
+                elif admin_view == "Logs": admin_logs_fragment()
+                elif admin_view == "📈 Routing": admin_routing_fragment()
+                elif admin_view == "🔥 Warm Cache": admin_warm_cache_fragment()
+                else: admin_sync_fragment()
+
+    # --- CHAT INTERFACE ---
+    st.divider()
+    chat_fragment(user)
+
 # --- ENTRY ---
 if st.session_state.user_info is None:
     login_page()
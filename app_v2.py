@@ -8,6 +8,8 @@ import hashlib
 import pandas as pd # Χρειαζόμαστε pandas για τους πίνακες
 from datetime import datetime
 from PIL import Image
+from model_router import ModelRouter, summarize_route_metrics
+from shared_state import open_shared_state, LeaseError
 
 # --- ΡΥΘΜΙΣΕΙΣ ΣΕΛΙΔΑΣ ---
 st.set_page_config(page_title="HVAC Expert Manager", page_icon="🛡️", layout="wide")
@@ -22,7 +24,14 @@ st.markdown("""<style>
 # --- GLOBAL SETTINGS ---
 USERS_DB_FILE = "local_users_db.json" 
 LOGS_DB_FILE = "chat_logs.json" # ΝΕΟ ΑΡΧΕΙΟ ΚΑΤΑΓΡΑΦΗΣ
+LOG_STREAM = "chat_logs" # Append-only logs στο shared backend πριν το compact
+LOG_COMPACT_EVERY = 100
 ACTIVE_MODEL_NAME = None 
+ROUTING_METRICS_FILE = "routing_metrics.jsonl" # Latency/κόστος ανά tier για tuning
+MODEL_TIERS = {"fast": None, "strong": None}
+ROUTER = ModelRouter(MODEL_TIERS, ["Θέρμανση"], ROUTING_METRICS_FILE)
+BUSY_MSG = "⏳ Άλλη εγγραφή είναι σε εξέλιξη, δοκιμάστε ξανά σε λίγο."
+CHAT_HISTORY_WINDOW = 20 # Πόσα μηνύματα ζωγραφίζονται σε κάθε rerun
 
 # --- 1. SETUP GEMINI AI ---
 if "GEMINI_KEY" in st.secrets:
@@ -41,6 +50,9 @@ if "GEMINI_KEY" in st.secrets:
         
         if selected:
             ACTIVE_MODEL_NAME = selected
+            # Router tiers: φθηνό/γρήγορο πρώτα, ισχυρό για κλιμάκωση (fallback στο ACTIVE_MODEL_NAME)
+            MODEL_TIERS["fast"] = next((p for p in ["models/gemini-1.5-flash"] if p in available_models), selected)
+            MODEL_TIERS["strong"] = next((p for p in ["models/gemini-1.5-pro", "models/gemini-pro"] if p in available_models), selected)
         else:
             st.error("❌ Κρίσιμο Σφάλμα: Δεν βρέθηκαν μοντέλα.")
             st.stop()
@@ -58,14 +70,37 @@ def load_data(filename):
     except: return {} if "users" in filename else []
 
 def save_data(filename, data):
-    with open(filename, "w", encoding="utf-8") as f: json.dump(data, f, indent=4, default=str)
+    # Atomic replace: άλλο replica δεν διαβάζει ποτέ μισογραμμένο αρχείο
+    tmp = f"{filename}.{os.getpid()}.tmp"
+    with open(tmp, "w", encoding="utf-8") as f: json.dump(data, f, indent=4, default=str)
+    os.replace(tmp, filename)
+
+@st.cache_resource
+def get_shared_state():
+    """Ένα backend ανά process: leases μεταξύ replicas (βλ. shared_state.py)"""
+    return open_shared_state(st.secrets["SHARED_STATE_URL"] if "SHARED_STATE_URL" in st.secrets else None)
+
+SHARED = get_shared_state()
+
+def update_users(change):
+    """Read-modify-write του users αρχείου κάτω από lease (ασφαλές για πολλά replicas).
+    Επιστρέφει False (με μήνυμα στον χρήστη) αν το lease δεν αποκτήθηκε ή χάθηκε."""
+    try:
+        with SHARED.lease("users") as lease:
+            users = load_data(USERS_DB_FILE)
+            change(users)
+            lease.check()
+            save_data(USERS_DB_FILE, users)
+        return True
+    except LeaseError:
+        st.error(BUSY_MSG)
+        return False
 
 def hash_pass(password):
     return hashlib.sha256(password.encode()).hexdigest()
 
 def log_interaction(user_email, question, answer, tech_type):
     """Καταγράφει την ερώτηση και την απάντηση κρυφά"""
-    logs = load_data(LOGS_DB_FILE)
     entry = {
         "timestamp": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
         "user": user_email,
@@ -73,8 +108,17 @@ def log_interaction(user_email, question, answer, tech_type):
         "question": question,
         "answer": answer[:100] + "..." # Αποθηκεύουμε την αρχή για οικονομία χώρου ή όλη αν θες
     }
-    logs.append(entry)
-    save_data(LOGS_DB_FILE, logs)
+    # Append-only στο shared backend (χωρίς lease ανά chat turn), compact ανά LOG_COMPACT_EVERY
+    try:
+        if SHARED.append_record(LOG_STREAM, entry) % LOG_COMPACT_EVERY == 0: compact_chat_logs()
+    except Exception as e: print(f"Log skipped: {e}")
+
+def compact_chat_logs():
+    """Μεταφέρει τα εκκρεμή logs στο LOGS_DB_FILE (ένα replica τη φορά, non-blocking)"""
+    def load():
+        if not os.path.exists(LOGS_DB_FILE): return []
+        with open(LOGS_DB_FILE, "r", encoding="utf-8") as f: return json.load(f) # Χαλασμένο αρχείο -> exception, όχι []
+    return SHARED.compact(LOG_STREAM, load, lambda data: save_data(LOGS_DB_FILE, data))
 
 # --- 3. HELPER FUNCTIONS ---
 def save_uploaded_file(uploaded_file):
@@ -88,7 +132,6 @@ def save_uploaded_file(uploaded_file):
 
 def analyze_media_and_chat(prompt, file_paths_list, history, tech_type):
     try:
-        model = genai.GenerativeModel(ACTIVE_MODEL_NAME)
         content_parts = []
         
         system_msg = f"""
@@ -112,8 +155,10 @@ def analyze_media_and_chat(prompt, file_paths_list, history, tech_type):
         for msg in history: content_parts.append(f"{'User' if msg['role']=='user' else 'Expert'}: {msg['content']}")
         content_parts.append(f"User Question: {prompt}")
 
-        response = model.generate_content(content_parts, safety_settings=SAFETY_SETTINGS)
-        return response.text if response.candidates else "⚠️ Μπλοκαρίστηκε από το AI."
+        attachment_bytes = sum(os.path.getsize(p) for p in file_paths_list or [] if os.path.exists(p))
+        tier = ROUTER.route(prompt, bool(file_paths_list), tech_type)
+        text, _, reason = ROUTER.generate(content_parts, tier, len(prompt), attachment_bytes, safety_settings=SAFETY_SETTINGS)
+        return text if reason not in ("no_candidates", "empty") else "⚠️ Μπλοκαρίστηκε από το AI."
     except Exception as e: return f"⚠️ Σφάλμα: {str(e)}"
 
 # --- 4. AUTHENTICATION & ADMIN LOGIC ---
@@ -151,8 +196,9 @@ def login_screen():
         new_n = st.text_input("Ονοματεπώνυμο")
         new_p = st.text_input("Κωδικός", type="password")
         if st.button("Αίτημα Εγγραφής"):
-            if new_e in users: st.error("Το email υπάρχει ήδη.")
-            else:
+            created = []
+            def register(users):
+                if new_e in users: return
                 # Νέοι χρήστες είναι PENDING από προεπιλογή
                 users[new_e] = {
                     "email": new_e, 
@@ -162,10 +208,149 @@ def login_screen():
                     "status": "pending", # <--- SOS: Αναμονή έγκρισης
                     "joined": str(datetime.now())
                 }
-                save_data(USERS_DB_FILE, users)
-                st.success("✅ Το αίτημα εστάλη! Περιμένετε έγκριση από τον διαχειριστή.")
+                created.append(new_e)
+            if not update_users(register): pass
+            elif not created: st.error("Το email υπάρχει ήδη.")
+            else: st.success("✅ Το αίτημα εστάλη! Περιμένετε έγκριση από τον διαχειριστή.")
+
+# --- 5. FRAGMENTS (ανεξάρτητα reruns ανά panel) ---
+
+def render_chat_history(messages):
+    """Windowed rendering: μόνο τα τελευταία chat_window μηνύματα σε κάθε rerun.
+    Τα παλαιότερα ανοίγουν ανά CHAT_HISTORY_WINDOW και το παράθυρο μηδενίζει σε κάθε νέο μήνυμα."""
+    window = st.session_state.get("chat_window", CHAT_HISTORY_WINDOW)
+    hidden = max(0, len(messages) - window)
+    if hidden and st.button(f"⬆️ Εμφάνιση {min(hidden, CHAT_HISTORY_WINDOW)} παλαιότερων μηνυμάτων (από {hidden})"):
+        st.session_state.chat_window = window + CHAT_HISTORY_WINDOW
+        st.rerun(scope="fragment")
+    for m in messages[hidden:]:
+        with st.chat_message(m["role"]): st.markdown(m["content"])
+
+@st.fragment
+def chat_fragment():
+    st.title("⚡ HVAC Quick Expert")
+    
+    # Επιλογή Ειδικότητας
+    col1, col2 = st.columns([1,2])
+    with col1:
+        tech_type = st.radio("Ειδικότητα:", ["Κλιματισμός (AC)", "Ψύξη", "Θέρμανση"])
+    
+    # Uploads
+    final_paths = []
+    with st.expander("📸 Προσθήκη Φωτογραφίας/Manual", expanded=False):
+        inp_mode = st.radio("Πηγή:", ["📂 Αρχεία", "📷 Κάμερα"], horizontal=True)
+        if inp_mode == "📂 Αρχεία":
+            files = st.file_uploader("Επιλογή", type=["pdf","jpg","png"], accept_multiple_files=True)
+            if files:
+                for f in files:
+                    p = save_uploaded_file(f)
+                    if p: final_paths.append(p)
+        else:
+            cam = st.camera_input("Λήψη")
+            if cam:
+                p = save_uploaded_file(cam)
+                if p: final_paths.append(p)
+
+    if "messages" not in st.session_state: st.session_state.messages = []
+    render_chat_history(st.session_state.messages)
+
+    if prompt := st.chat_input("Περιγραφή προβλήματος..."):
+        st.session_state.chat_window = CHAT_HISTORY_WINDOW
+        st.session_state.messages.append({"role": "user", "content": prompt})
+        with st.chat_message("user"): st.markdown(prompt)
+
+        with st.chat_message("assistant"):
+            with st.spinner("🧠 Ανάλυση..."):
+                resp = analyze_media_and_chat(prompt, final_paths, st.session_state.messages[:-1], tech_type)
+                st.markdown(resp)
+        
+        st.session_state.messages.append({"role": "assistant", "content": resp})
+        
+        # --- ΚΡΥΦΗ ΚΑΤΑΓΡΑΦΗ (LOGGING) ---
+        log_interaction(st.session_state.user['email'], prompt, resp, tech_type)
+
+    if st.button("🔄 Νέα Ερώτηση"):
+        st.session_state.messages = []; st.session_state.chat_window = CHAT_HISTORY_WINDOW
+        st.rerun(scope="fragment")
+
+@st.fragment
+def users_fragment():
+    st.title("👥 Διαχείριση Προσωπικού")
+    users = load_data(USERS_DB_FILE)
+    
+    # Λίστα για επεξεργασία
+    st.write("---")
+    for email, u_data in users.items():
+        if email == "admin": continue # Μην πειράζουμε τον admin
+        
+        c1, c2, c3, c4 = st.columns([2, 1, 1, 1])
+        with c1:
+            st.write(f"**{u_data['name']}** ({email})")
+            st.caption(f"Εγγραφή: {u_data['joined']}")
+        with c2:
+            # Ένδειξη Status
+            status = u_data.get('status', 'pending')
+            if status == 'pending': st.warning("⏳ Αναμονή")
+            elif status == 'approved': st.success("✅ Ενεργός")
+            else: st.error("⛔ Blocked")
+        with c3:
+            # Κουμπιά Ενεργειών
+            if status != 'approved':
+                if st.button("✅ Έγκριση", key=f"app_{email}"):
+                    if update_users(lambda u: u.get(email, {}).update(status='approved')):
+                        st.rerun(scope="fragment")
+        with c4:
+            if status != 'blocked':
+                if st.button("⛔ Block", key=f"blk_{email}"):
+                    if update_users(lambda u: u.get(email, {}).update(status='blocked')):
+                        st.rerun(scope="fragment")
+            if st.button("🗑️ Διαγραφή", key=f"del_{email}"):
+                if update_users(lambda u: u.pop(email, None)):
+                    st.rerun(scope="fragment")
+        st.divider()
+
+@st.fragment
+def logs_fragment():
+    st.title("📊 Ιστορικό Ερωτήσεων & Στατιστικά")
+    compact_chat_logs()
+    logs = load_data(LOGS_DB_FILE) + SHARED.records(LOG_STREAM)
+    
+    if not logs:
+        st.info("Δεν υπάρχουν καταγεγραμμένες συνομιλίες ακόμα.")
+    else:
+        df = pd.DataFrame(logs)
+        
+        # Στατιστικά
+        st.subheader("Σύνοψη")
+        colA, colB = st.columns(2)
+        with colA:
+            st.metric("Σύνολο Ερωτήσεων", len(df))
+        with colB:
+            st.write("Ερωτήσεις ανά Ειδικότητα:")
+            st.bar_chart(df['type'].value_counts())
+
+        # Αναλυτικός Πίνακας
+        st.subheader("🕵️ Αναλυτικό Ιστορικό (Spy View)")
+        
+        # Φίλτρα
+        selected_user = st.selectbox("Φίλτρο ανά Χρήστη", ["Όλοι"] + list(df['user'].unique()))
+        if selected_user != "Όλοι":
+            df = df[df['user'] == selected_user]
 
-# --- 5. MAIN APP ---
+        # Εμφάνιση πίνακα
+        st.dataframe(
+            df[['timestamp', 'user', 'type', 'question', 'answer']], 
+            use_container_width=True,
+            height=400
+        )
+
+    # Model routing: latency/κόστος ανά tier για ρύθμιση των ROUTE_* thresholds
+    metrics = ROUTER.load_metrics()
+    if metrics:
+        st.subheader("📈 Model Routing")
+        st.dataframe(pd.DataFrame(summarize_route_metrics(metrics)), use_container_width=True)
+
+# --- 6. MAIN APP ---
 def main_app():
     user_role = st.session_state.user.get("role")
     
@@ -184,124 +369,10 @@ def main_app():
             admin_tab = "Εφαρμογή (Chat)"
             
     # --- LOGIC ΒΑΣΕΙ ΕΠΙΛΟΓΗΣ ---
-    
-    # 1. ΕΦΑΡΜΟΓΗ (Για όλους)
-    if admin_tab == "Εφαρμογή (Chat)":
-        st.title("⚡ HVAC Quick Expert")
-        
-        # Επιλογή Ειδικότητας
-        col1, col2 = st.columns([1,2])
-        with col1:
-            tech_type = st.radio("Ειδικότητα:", ["Κλιματισμός (AC)", "Ψύξη", "Θέρμανση"])
-        
-        # Uploads
-        final_paths = []
-        with st.expander("📸 Προσθήκη Φωτογραφίας/Manual", expanded=False):
-            inp_mode = st.radio("Πηγή:", ["📂 Αρχεία", "📷 Κάμερα"], horizontal=True)
-            if inp_mode == "📂 Αρχεία":
-                files = st.file_uploader("Επιλογή", type=["pdf","jpg","png"], accept_multiple_files=True)
-                if files:
-                    for f in files:
-                        p = save_uploaded_file(f)
-                        if p: final_paths.append(p)
-            else:
-                cam = st.camera_input("Λήψη")
-                if cam:
-                    p = save_uploaded_file(cam)
-                    if p: final_paths.append(p)
-
-        if "messages" not in st.session_state: st.session_state.messages = []
-        for m in st.session_state.messages:
-            with st.chat_message(m["role"]): st.markdown(m["content"])
-
-        if prompt := st.chat_input("Περιγραφή προβλήματος..."):
-            st.session_state.messages.append({"role": "user", "content": prompt})
-            with st.chat_message("user"): st.markdown(prompt)
-
-            with st.chat_message("assistant"):
-                with st.spinner("🧠 Ανάλυση..."):
-                    resp = analyze_media_and_chat(prompt, final_paths, st.session_state.messages[:-1], tech_type)
-                    st.markdown(resp)
-            
-            st.session_state.messages.append({"role": "assistant", "content": resp})
-            
-            # --- ΚΡΥΦΗ ΚΑΤΑΓΡΑΦΗ (LOGGING) ---
-            log_interaction(st.session_state.user['email'], prompt, resp, tech_type)
-
-        if st.button("🔄 Νέα Ερώτηση"): st.session_state.messages = []; st.rerun()
-
-    # 2. ΔΙΑΧΕΙΡΙΣΗ ΧΡΗΣΤΩΝ (Μόνο Admin)
-    elif admin_tab == "👥 Χρήστες & Εγκρίσεις":
-        st.title("👥 Διαχείριση Προσωπικού")
-        users = load_data(USERS_DB_FILE)
-        
-        # Λίστα για επεξεργασία
-        st.write("---")
-        for email, u_data in users.items():
-            if email == "admin": continue # Μην πειράζουμε τον admin
-            
-            c1, c2, c3, c4 = st.columns([2, 1, 1, 1])
-            with c1:
-                st.write(f"**{u_data['name']}** ({email})")
-                st.caption(f"Εγγραφή: {u_data['joined']}")
-            with c2:
-                # Ένδειξη Status
-                status = u_data.get('status', 'pending')
-                if status == 'pending': st.warning("⏳ Αναμονή")
-                elif status == 'approved': st.success("✅ Ενεργός")
-                else: st.error("⛔ Blocked")
-            with c3:
-                # Κουμπιά Ενεργειών
-                if status != 'approved':
-                    if st.button("✅ Έγκριση", key=f"app_{email}"):
-                        users[email]['status'] = 'approved'
-                        save_data(USERS_DB_FILE, users)
-                        st.rerun()
-            with c4:
-                if status != 'blocked':
-                    if st.button("⛔ Block", key=f"blk_{email}"):
-                        users[email]['status'] = 'blocked'
-                        save_data(USERS_DB_FILE, users)
-                        st.rerun()
-                if st.button("🗑️ Διαγραφή", key=f"del_{email}"):
-                    del users[email]
-                    save_data(USERS_DB_FILE, users)
-                    st.rerun()
-            st.divider()
-
-    # 3. STATS & LOGS (Μόνο Admin)
-    elif admin_tab == "📊 Καταγραφή (Logs)":
-        st.title("📊 Ιστορικό Ερωτήσεων & Στατιστικά")
-        logs = load_data(LOGS_DB_FILE)
-        
-        if not logs:
-            st.info("Δεν υπάρχουν καταγεγραμμένες συνομιλίες ακόμα.")
-        else:
-            df = pd.DataFrame(logs)
-            
-            # Στατιστικά
-            st.subheader("Σύνοψη")
-            colA, colB = st.columns(2)
-            with colA:
-                st.metric("Σύνολο Ερωτήσεων", len(df))
-            with colB:
-                st.write("Ερωτήσεις ανά Ειδικότητα:")
-                st.bar_chart(df['type'].value_counts())
-
-            # Αναλυτικός Πίνακας
-            st.subheader("🕵️ Αναλυτικό Ιστορικό (Spy View)")
-            
-            # Φίλτρα
-            selected_user = st.selectbox("Φίλτρο ανά Χρήστη", ["Όλοι"] + list(df['user'].unique()))
-            if selected_user != "Όλοι":
-                df = df[df['user'] == selected_user]
-
-            # Εμφάνιση πίνακα
-            st.dataframe(
-                df[['timestamp', 'user', 'type', 'question', 'answer']], 
-                use_container_width=True,
-                height=400
-            )
+    # Κάθε panel είναι fragment: μόνο το επιλεγμένο τρέχει και φορτώνει δεδομένα.
+    if admin_tab == "Εφαρμογή (Chat)": chat_fragment()        # 1. Για όλους
+    elif admin_tab == "👥 Χρήστες & Εγκρίσεις": users_fragment() # 2. Μόνο Admin
+    elif admin_tab == "📊 Καταγραφή (Logs)": logs_fragment()     # 3. Μόνο Admin
 
 if st.session_state.user: main_app()
 else: login_screen()
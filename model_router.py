@@ -0,0 +1,130 @@
+"""Cost- και latency-aware routing μοντέλων (cheap-first cascade), κοινό για app.py και app_v2.py.
+
+Κάθε ερώτηση πάει σε tier (fast / strong) βάσει μήκους, attachments, μεγέθους manual
+και ειδικότητας. Αν η γρήγορη απάντηση είναι αδύναμη, κλιμακώνεται στο ισχυρό μοντέλο.
+Latency, tokens και κόστος κάθε κλήσης γράφονται σε JSONL για tuning των thresholds.
+"""
+import datetime
+import json
+import os
+import re
+import time
+
+import google.generativeai as genai
+
+ROUTE_LONG_PROMPT_CHARS = 250 # Πάνω από αυτό -> κατευθείαν στο ισχυρό μοντέλο
+ROUTE_LARGE_ATTACHMENT_BYTES = 10 * 1024 * 1024 # Manual πάνω από αυτό -> κατευθείαν στο ισχυρό μοντέλο
+ROUTE_MIN_CONFIDENCE = 6 # Αυτοαξιολόγηση κάτω από αυτό -> κλιμάκωση
+# Ενδεικτικό κόστος (USD / 1K tokens) ανά tier - ρυθμίζεται από τα πραγματικά τιμολόγια
+TIER_COST_PER_1K = {"fast": {"in": 0.000075, "out": 0.0003}, "strong": {"in": 0.00125, "out": 0.005}}
+REFUSAL_MARKERS = ["δεν μπορώ να", "δεν είμαι σε θέση", "i can't", "i cannot", "i'm unable", "as an ai"]
+CONFIDENCE_INSTRUCTION = "Στο τέλος γράψε σε ξεχωριστή γραμμή: CONFIDENCE: <1-10> (πόσο σίγουρος είσαι για την απάντηση)."
+# Μόνο αυτόνομη γραμμή "CONFIDENCE: N" (προαιρετικά /10 ή **bold**), ποτέ μέσα στο κείμενο
+CONFIDENCE_RE = re.compile(r"^\s*(?:\*\*)?CONFIDENCE\s*:\s*(\d+)(?:\s*/\s*10)?(?:\*\*)?\s*$", re.IGNORECASE | re.MULTILINE)
+
+
+def split_confidence(text):
+    """Αφαιρεί την τελευταία γραμμή CONFIDENCE από την απάντηση -> (text, score ή None)"""
+    matches = list(CONFIDENCE_RE.finditer(text or ""))
+    if not matches: return (text or "").strip(), None
+    m = matches[-1]
+    return (text[:m.start()] + text[m.end():]).strip(), int(m.group(1))
+
+def weak_answer_reason(resp, text, confidence):
+    """Γιατί η απάντηση θεωρείται αδύναμη (None = εντάξει)"""
+    if not resp.candidates: return "no_candidates"
+    if not text: return "empty"
+    if any(r in text[:300].lower() for r in REFUSAL_MARKERS): return "refusal"
+    if confidence is not None and confidence < ROUTE_MIN_CONFIDENCE: return "low_confidence"
+    return None
+
+def summarize_route_metrics(metrics):
+    """Σύνοψη ανά tier: πλήθος, μέσο latency, tokens, κόστος, ποσοστό κλιμάκωσης"""
+    summary = {}
+    for m in metrics:
+        s = summary.setdefault(m["tier"], {"tier": m["tier"], "calls": 0, "latency_ms": 0, "tokens": 0, "cost_usd": 0.0, "weak": 0, "escalated": 0})
+        s["calls"] += 1
+        s["latency_ms"] += m.get("latency_ms", 0)
+        s["tokens"] += m.get("tokens_in", 0) + m.get("tokens_out", 0)
+        s["cost_usd"] += m.get("cost_usd", 0.0)
+        s["weak"] += 1 if m.get("weak_reason") else 0
+        s["escalated"] += 1 if m.get("escalated") else 0
+    rows = []
+    for s in summary.values():
+        rows.append({
+            "tier": s["tier"], "calls": s["calls"],
+            "avg_latency_ms": s["latency_ms"] // s["calls"],
+            "avg_tokens": s["tokens"] // s["calls"],
+            "total_cost_usd": round(s["cost_usd"], 4),
+            "weak_rate": f"{s['weak'] / s['calls']:.0%}",
+            "escalations": s["escalated"],
+        })
+    return rows
+
+
+class ModelRouter:
+    """tiers: {"fast": model, "strong": model} - το ίδιο dict που γεμίζει η εφαρμογή στο startup"""
+
+    def __init__(self, tiers, strong_tech_modes, metrics_file):
+        self.tiers = tiers
+        self.strong_tech_modes = strong_tech_modes
+        self.metrics_file = metrics_file
+
+    def route(self, prompt, has_attachments=False, tech_mode=None, manual_found=False, attachment_bytes=0):
+        """Επιλογή tier: σύντομες/απλές ερωτήσεις στο γρήγορο, σύνθετες στο ισχυρό.
+        has_attachments: φωτογραφίες/αρχεία του χρήστη. Το manual του chat μετράει μόνο με το μέγεθός του
+        (attachment_bytes), ώστε οι μικρές ερωτήσεις με manual να περνάνε πρώτα από το γρήγορο."""
+        if has_attachments or len(prompt) > ROUTE_LONG_PROMPT_CHARS: return "strong"
+        if attachment_bytes > ROUTE_LARGE_ATTACHMENT_BYTES: return "strong"
+        if tech_mode in self.strong_tech_modes and not manual_found: return "strong"
+        return "fast"
+
+    def record_metrics(self, entry):
+        """Append-only JSONL (φθηνό) για tuning των thresholds από πραγματικά δεδομένα"""
+        try:
+            with open(self.metrics_file, "a", encoding="utf-8") as f: f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+        except: pass
+
+    def load_metrics(self):
+        if not os.path.exists(self.metrics_file): return []
+        try:
+            with open(self.metrics_file, "r", encoding="utf-8") as f: return [json.loads(l) for l in f if l.strip()]
+        except: return []
+
+    def generate(self, parts, tier, prompt_chars=0, attachment_bytes=0, **gen_kwargs):
+        """Cheap-first cascade: αν η γρήγορη απάντηση είναι αδύναμη, ξαναρωτάμε το ισχυρό μοντέλο.
+        Επιστρέφει (text, model_name, weak_reason)."""
+        tiers = ["fast", "strong"] if tier == "fast" and self.tiers["fast"] != self.tiers["strong"] else [tier]
+        for i, t in enumerate(tiers):
+            model_name = self.tiers[t]
+            start = time.time()
+            text, confidence, tokens_in, tokens_out, error = "", None, 0, 0, None
+            try:
+                resp = genai.GenerativeModel(model_name).generate_content(parts + [CONFIDENCE_INSTRUCTION], **gen_kwargs)
+                try: text, confidence = split_confidence(resp.text)
+                except ValueError: pass # Μπλοκαρισμένη απάντηση χωρίς text
+                reason = weak_answer_reason(resp, text, confidence)
+                usage = getattr(resp, "usage_metadata", None)
+                tokens_in = getattr(usage, "prompt_token_count", 0) or 0
+                tokens_out = getattr(usage, "candidates_token_count", 0) or 0
+            except Exception as e:
+                reason, error = "error", e
+            prices = TIER_COST_PER_1K[t]
+            self.record_metrics({
+                "timestamp": datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+                "routed_tier": tier,
+                "tier": t,
+                "model": model_name,
+                "escalated": i > 0,
+                "latency_ms": int((time.time() - start) * 1000),
+                "tokens_in": tokens_in,
+                "tokens_out": tokens_out,
+                "cost_usd": round(tokens_in / 1000 * prices["in"] + tokens_out / 1000 * prices["out"], 6),
+                "confidence": confidence,
+                "weak_reason": reason,
+                "prompt_chars": prompt_chars,
+                "attachment_bytes": attachment_bytes,
+            })
+            if reason is None or i == len(tiers) - 1:
+                if error: raise error
+                return text, model_name, reason
@@ -0,0 +1,300 @@
+"""Κοινή κατάσταση για πολλά replicas της εφαρμογής (πίσω από load balancer).
+
+- Leases: κλείδωμα με λήξη για read-modify-write σε index / users.
+- Change feed: κάθε αλλαγή στο index δημοσιεύεται ώστε τα άλλα replicas να
+  ενημερώνουν το in-memory index τους χωρίς πλήρες reload από το Drive.
+- Append-only records: τα logs γράφονται ως ξεχωριστές εγγραφές χωρίς lease
+  και μεταφέρονται περιοδικά (compact) στο κύριο αρχείο logs.
+
+Backends: SQLite (ίδιο host ή κοινό volume) και Redis (networked, προαιρετικό).
+"""
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from abc import ABC, abstractmethod
+from contextlib import closing, contextmanager
+
+DEFAULT_STATE_URL = "sqlite:///hvac_shared_state.db"
+LEASE_TTL = 30 # sec - λήγει μόνο του αν πέσει το replica που το κρατάει (αλλιώς ανανεώνεται)
+LEASE_WAIT = 30 # sec - μέγιστη αναμονή για απόκτηση
+LEASE_POLL = 0.05
+CHANGE_KEEP = 5000 # Πόσες αλλαγές κρατάμε, πιο παλιό baseline -> πλήρες reload
+
+
+class LeaseError(Exception):
+    """Βάση για τα σφάλματα lease"""
+
+
+class LeaseTimeout(LeaseError, TimeoutError):
+    """Το lease κρατιέται από άλλο replica για περισσότερο από LEASE_WAIT"""
+
+
+class LeaseLost(LeaseError):
+    """Το lease έληξε και το πήρε άλλο replica πριν ολοκληρωθεί η εγγραφή"""
+
+
+class Lease:
+    """Handle ενός lease που κρατάμε. Ένα heartbeat thread το ανανεώνει κάθε ttl/3,
+    ώστε μια αργή εγγραφή στο Drive να μην το αφήσει να λήξει."""
+
+    def __init__(self, state, name, token, ttl):
+        self.state, self.name, self.token, self.ttl = state, name, token, ttl
+        self.expired_at_release = False
+        self._stop = threading.Event()
+        self._heartbeat = threading.Thread(target=self._renew_loop, daemon=True)
+        self._heartbeat.start()
+
+    def _renew_loop(self):
+        while not self._stop.wait(self.ttl / 3):
+            if not self.state.renew(self.name, self.token, self.ttl): return
+
+    def check(self):
+        """Fencing: ανανέωση + επιβεβαίωση ότι το κρατάμε ακόμα - καλείται ακριβώς πριν από κάθε εγγραφή"""
+        if not self.state.renew(self.name, self.token, self.ttl):
+            raise LeaseLost(f"Lease '{self.name}' expired and was taken by another replica")
+
+    def stop(self):
+        self._stop.set()
+        self._heartbeat.join()
+
+
+class SharedState(ABC):
+    """Κοινή διεπαφή των backends"""
+
+    @abstractmethod
+    def try_acquire(self, name, token, ttl): ...
+
+    @abstractmethod
+    def renew(self, name, token, ttl):
+        """Παράταση μόνο αν το token κρατάει ακόμα το lease -> bool"""
+
+    @abstractmethod
+    def release(self, name, token):
+        """-> True αν το token κρατούσε ακόμα το lease"""
+
+    @abstractmethod
+    def publish(self, channel, key, value): ...
+
+    @abstractmethod
+    def last_change_id(self): ...
+
+    @abstractmethod
+    def changes_since(self, channel, since):
+        """-> (changes, last_id). changes = [{"id", "key", "value"}] ή None αν το
+        baseline είναι παλαιότερο από όσα κρατάμε (χρειάζεται πλήρες reload)."""
+
+    @abstractmethod
+    def append_record(self, stream, record):
+        """Append-only εγγραφή (χωρίς lease) -> id"""
+
+    @abstractmethod
+    def records(self, stream):
+        """Όλες οι εκκρεμείς εγγραφές, με το id τους στο πεδίο "log_id", σε σειρά id"""
+
+    @abstractmethod
+    def trim_records(self, stream, upto_id):
+        """Σβήνει τις εγγραφές με id <= upto_id (μετά από compact)"""
+
+    def compact(self, stream, load, save):
+        """Μεταφέρει τις εκκρεμείς εγγραφές στο κύριο αρχείο: data = load(); save(data).
+        save αποτυχημένη = exception ή False. Non-blocking: αν άλλο replica κάνει ήδη
+        compact, επιστρέφει False. Τα log_id αποτρέπουν διπλές εγγραφές αν πέσει πριν το trim."""
+        try:
+            with self.lease(f"compact:{stream}", timeout=0) as lease:
+                pending = self.records(stream)
+                if not pending: return True
+                data = load() or []
+                seen = {e.get("log_id") for e in data if isinstance(e, dict) and e.get("log_id", 0) >= pending[0]["log_id"]}
+                data.extend(r for r in pending if r["log_id"] not in seen)
+                lease.check()
+                if save(data) is False: return False
+                self.trim_records(stream, pending[-1]["log_id"])
+                return True
+        except LeaseError:
+            return False
+
+    @contextmanager
+    def lease(self, name, ttl=LEASE_TTL, timeout=LEASE_WAIT):
+        """with state.lease("users") as lease: ... lease.check(); save(...)"""
+        token = uuid.uuid4().hex # Ανά απόκτηση: και τα threads του ίδιου process αποκλείονται
+        deadline = time.time() + timeout
+        while not self.try_acquire(name, token, ttl):
+            if time.time() > deadline: raise LeaseTimeout(f"Lease '{name}' is busy")
+            time.sleep(LEASE_POLL)
+        lease = Lease(self, name, token, ttl)
+        try: yield lease
+        except BaseException:
+            lease.stop(); self.release(name, token)
+            raise
+        lease.stop()
+        # Το fence είναι το lease.check() πριν την εγγραφή: εδώ η εγγραφή έχει ήδη γίνει,
+        # οπότε η λήξη μόνο καταγράφεται (δεν είναι αποτυχημένη εγγραφή)
+        if not self.release(name, token):
+            lease.expired_at_release = True
+            print(f"Lease '{name}' expired before release")
+
+
+class SQLiteSharedState(SharedState):
+    def __init__(self, path):
+        self.path = path
+        with closing(self._connect()) as db:
+            db.execute("PRAGMA journal_mode=WAL")
+            db.executescript("""
+                CREATE TABLE IF NOT EXISTS leases (name TEXT PRIMARY KEY, token TEXT, expires REAL);
+                CREATE TABLE IF NOT EXISTS changes (id INTEGER PRIMARY KEY AUTOINCREMENT, channel TEXT, key TEXT, value TEXT);
+                CREATE INDEX IF NOT EXISTS changes_channel ON changes (channel, id);
+                CREATE TABLE IF NOT EXISTS records (id INTEGER PRIMARY KEY AUTOINCREMENT, stream TEXT, value TEXT);
+                CREATE INDEX IF NOT EXISTS records_stream ON records (stream, id);
+            """)
+
+    def _connect(self):
+        return sqlite3.connect(self.path, timeout=LEASE_WAIT, isolation_level=None)
+
+    def try_acquire(self, name, token, ttl):
+        now = time.time()
+        with closing(self._connect()) as db:
+            db.execute("BEGIN IMMEDIATE")
+            row = db.execute("SELECT token, expires FROM leases WHERE name = ?", (name,)).fetchone()
+            if row and row[0] != token and row[1] > now:
+                db.execute("ROLLBACK")
+                return False
+            db.execute("INSERT OR REPLACE INTO leases VALUES (?, ?, ?)", (name, token, now + ttl))
+            db.execute("COMMIT")
+            return True
+
+    def renew(self, name, token, ttl):
+        now = time.time()
+        with closing(self._connect()) as db:
+            cur = db.execute("UPDATE leases SET expires = ? WHERE name = ? AND token = ? AND expires > ?",
+                             (now + ttl, name, token, now))
+            return cur.rowcount == 1
+
+    def release(self, name, token):
+        with closing(self._connect()) as db:
+            cur = db.execute("DELETE FROM leases WHERE name = ? AND token = ? AND expires > ?", (name, token, time.time()))
+            return cur.rowcount == 1
+
+    def publish(self, channel, key, value):
+        with closing(self._connect()) as db:
+            db.execute("BEGIN IMMEDIATE")
+            cid = db.execute("INSERT INTO changes (channel, key, value) VALUES (?, ?, ?)",
+                             (channel, key, json.dumps(value, ensure_ascii=False))).lastrowid
+            db.execute("DELETE FROM changes WHERE id <= ?", (cid - CHANGE_KEEP,))
+            db.execute("COMMIT")
+            return cid
+
+    def _last_id(self, db):
+        row = db.execute("SELECT seq FROM sqlite_sequence WHERE name = 'changes'").fetchone()
+        return row[0] if row else 0
+
+    def last_change_id(self):
+        with closing(self._connect()) as db: return self._last_id(db)
+
+    def changes_since(self, channel, since):
+        with closing(self._connect()) as db:
+            db.execute("BEGIN") # Ένα snapshot για last_id και rows
+            last_id = self._last_id(db)
+            if since < last_id - CHANGE_KEEP:
+                db.execute("COMMIT")
+                return None, last_id
+            rows = db.execute("SELECT id, key, value FROM changes WHERE channel = ? AND id > ? AND id <= ? ORDER BY id",
+                              (channel, since, last_id)).fetchall()
+            db.execute("COMMIT")
+        return [{"id": i, "key": k, "value": json.loads(v)} for i, k, v in rows], last_id
+
+    def append_record(self, stream, record):
+        with closing(self._connect()) as db:
+            return db.execute("INSERT INTO records (stream, value) VALUES (?, ?)",
+                              (stream, json.dumps(record, ensure_ascii=False))).lastrowid
+
+    def records(self, stream):
+        with closing(self._connect()) as db:
+            rows = db.execute("SELECT id, value FROM records WHERE stream = ? ORDER BY id", (stream,)).fetchall()
+        return [dict(json.loads(v), log_id=i) for i, v in rows]
+
+    def trim_records(self, stream, upto_id):
+        with closing(self._connect()) as db:
+            db.execute("DELETE FROM records WHERE stream = ? AND id <= ?", (stream, upto_id))
+
+
+# INCR + ZADD ατομικά: κανένας αναγνώστης δεν βλέπει id N+1 πριν το N
+_REDIS_PUBLISH = """
+local id = redis.call('INCR', KEYS[2])
+redis.call('ZADD', KEYS[1], id, cjson.encode({id, ARGV[1], ARGV[2], ARGV[3]}))
+redis.call('ZREMRANGEBYSCORE', KEYS[1], '-inf', id - tonumber(ARGV[4]))
+return id
+"""
+_REDIS_APPEND = """
+local id = redis.call('INCR', KEYS[2])
+redis.call('ZADD', KEYS[1], id, cjson.encode({id, ARGV[1]}))
+return id
+"""
+_REDIS_RELEASE = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then return redis.call('DEL', KEYS[1]) end
+return 0
+"""
+_REDIS_RENEW = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then return redis.call('PEXPIRE', KEYS[1], ARGV[2]) end
+return 0
+"""
+
+class RedisSharedState(SharedState):
+    def __init__(self, url, prefix="hvac"):
+        try:
+            import redis
+        except ImportError:
+            raise RuntimeError("Το redis:// backend χρειάζεται: pip install redis")
+        self.r = redis.Redis.from_url(url, decode_responses=True)
+        self.changes_key, self.seq_key = f"{prefix}:changes", f"{prefix}:changes:seq"
+        self.prefix = prefix
+
+    def try_acquire(self, name, token, ttl):
+        return bool(self.r.set(f"{self.prefix}:lease:{name}", token, nx=True, px=int(ttl * 1000)))
+
+    def renew(self, name, token, ttl):
+        return bool(self.r.eval(_REDIS_RENEW, 1, f"{self.prefix}:lease:{name}", token, int(ttl * 1000)))
+
+    def release(self, name, token):
+        return bool(self.r.eval(_REDIS_RELEASE, 1, f"{self.prefix}:lease:{name}", token))
+
+    def publish(self, channel, key, value):
+        return int(self.r.eval(_REDIS_PUBLISH, 2, self.changes_key, self.seq_key,
+                               channel, key, json.dumps(value, ensure_ascii=False), CHANGE_KEEP))
+
+    def last_change_id(self):
+        return int(self.r.get(self.seq_key) or 0)
+
+    def changes_since(self, channel, since):
+        pipe = self.r.pipeline(transaction=True)
+        pipe.get(self.seq_key)
+        pipe.zrangebyscore(self.changes_key, f"({since}", "+inf")
+        last_id, members = pipe.execute()
+        last_id = int(last_id or 0)
+        if since < last_id - CHANGE_KEEP: return None, last_id
+        changes = []
+        for m in members:
+            cid, ch, key, value = json.loads(m)
+            if ch == channel and cid <= last_id: changes.append({"id": cid, "key": key, "value": json.loads(value)})
+        return changes, last_id
+
+    def append_record(self, stream, record):
+        return int(self.r.eval(_REDIS_APPEND, 2, f"{self.prefix}:records:{stream}", f"{self.prefix}:records:{stream}:seq",
+                               json.dumps(record, ensure_ascii=False)))
+
+    def records(self, stream):
+        members = self.r.zrangebyscore(f"{self.prefix}:records:{stream}", "-inf", "+inf")
+        return [dict(json.loads(value), log_id=rid) for rid, value in map(json.loads, members)]
+
+    def trim_records(self, stream, upto_id):
+        self.r.zremrangebyscore(f"{self.prefix}:records:{stream}", "-inf", upto_id)
+
+
+def open_shared_state(url=None):
+    """sqlite:///path (default) ή redis://host:port/db"""
+    url = url or os.environ.get("HVAC_SHARED_STATE_URL") or DEFAULT_STATE_URL
+    if url.startswith(("redis://", "rediss://")): return RedisSharedState(url)
+    if url.startswith("sqlite:///"): return SQLiteSharedState(url[len("sqlite:///"):])
+    raise ValueError(f"Άγνωστο shared state backend: {url}")
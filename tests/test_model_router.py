@@ -0,0 +1,53 @@
+import sys
+import types
+from types import SimpleNamespace
+
+# Το SDK του Gemini δεν χρειάζεται για τις pure συναρτήσεις του router
+if "google.generativeai" not in sys.modules:
+    try:
+        import google.generativeai # noqa: F401
+    except ImportError:
+        sys.modules.setdefault("google", types.ModuleType("google"))
+        sys.modules["google.generativeai"] = types.ModuleType("google.generativeai")
+
+from model_router import ROUTE_LARGE_ATTACHMENT_BYTES, ROUTE_LONG_PROMPT_CHARS, ModelRouter, split_confidence, weak_answer_reason
+
+
+def test_split_confidence_uses_standalone_last_line():
+    text, score = split_confidence("Η πίεση confidence 9 ok\nβήμα 2\nCONFIDENCE: 3")
+    assert score == 3
+    assert text == "Η πίεση confidence 9 ok\nβήμα 2"
+
+
+def test_split_confidence_accepts_out_of_ten_and_bold():
+    assert split_confidence("Απάντηση\n**CONFIDENCE: 8/10**") == ("Απάντηση", 8)
+
+
+def test_split_confidence_without_rating():
+    assert split_confidence("  Απάντηση  ") == ("Απάντηση", None)
+    assert split_confidence(None) == ("", None)
+
+
+def test_weak_answer_reason():
+    ok = SimpleNamespace(candidates=[object()])
+    assert weak_answer_reason(SimpleNamespace(candidates=[]), "", None) == "no_candidates"
+    assert weak_answer_reason(ok, "", None) == "empty"
+    assert weak_answer_reason(ok, "I cannot help with that.", 9) == "refusal"
+    assert weak_answer_reason(ok, "Έλεγξε τον αισθητήρα.", 3) == "low_confidence"
+    assert weak_answer_reason(ok, "Έλεγξε τον αισθητήρα.", 8) is None
+    assert weak_answer_reason(ok, "Έλεγξε τον αισθητήρα.", None) is None
+
+
+def test_route():
+    router = ModelRouter({"fast": "f", "strong": "s"}, ["🔥 Καυστήρες"], "unused.jsonl")
+    assert router.route("E5") == "fast"
+    assert router.route("x" * (ROUTE_LONG_PROMPT_CHARS + 1)) == "strong"
+    assert router.route("E5", has_attachments=True) == "strong"
+    assert router.route("E5", tech_mode="🔥 Καυστήρες") == "strong"
+    assert router.route("E5", tech_mode="🔥 Καυστήρες", manual_found=True) == "fast"
+
+
+def test_route_manual_by_size():
+    router = ModelRouter({"fast": "f", "strong": "s"}, ["🔥 Καυστήρες"], "unused.jsonl")
+    assert router.route("E5", manual_found=True, attachment_bytes=2 * 1024 * 1024) == "fast"
+    assert router.route("E5", manual_found=True, attachment_bytes=ROUTE_LARGE_ATTACHMENT_BYTES + 1) == "strong"
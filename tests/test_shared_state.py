@@ -0,0 +1,121 @@
+import json
+import multiprocessing
+import os
+import time
+
+import pytest
+
+from shared_state import LeaseLost, SharedState, SQLiteSharedState, open_shared_state
+
+WORKERS = 6
+ITERATIONS = 50
+
+
+def _increment_worker(url, counter_path, iterations):
+    state = open_shared_state(url)
+    for i in range(iterations):
+        with state.lease("counter") as lease:
+            with open(counter_path, encoding="utf-8") as f: data = json.load(f)
+            data["n"] += 1
+            lease.check()
+            with open(counter_path, "w", encoding="utf-8") as f: json.dump(data, f)
+            state.publish("index", f"{os.getpid()}-{i}", {"i": i})
+
+
+def test_no_lost_updates_across_processes(tmp_path):
+    url = f"sqlite:///{tmp_path / 'state.db'}"
+    counter_path = tmp_path / "counter.json"
+    counter_path.write_text(json.dumps({"n": 0}), encoding="utf-8")
+    open_shared_state(url) # Δημιουργία schema πριν ξεκινήσουν οι workers
+
+    workers = [multiprocessing.Process(target=_increment_worker, args=(url, str(counter_path), ITERATIONS))
+               for _ in range(WORKERS)]
+    for w in workers: w.start()
+    for w in workers: w.join(timeout=120)
+    assert all(w.exitcode == 0 for w in workers)
+
+    assert json.loads(counter_path.read_text(encoding="utf-8"))["n"] == WORKERS * ITERATIONS
+    changes, last_id = open_shared_state(url).changes_since("index", 0)
+    assert len(changes) == WORKERS * ITERATIONS
+    assert last_id == WORKERS * ITERATIONS
+
+
+def test_lease_is_renewed_while_held(tmp_path):
+    state = SQLiteSharedState(str(tmp_path / "state.db"))
+    with state.lease("x", ttl=0.2) as lease:
+        time.sleep(0.3)
+        assert not state.try_acquire("x", "other", 1)
+        lease.check()
+    assert state.try_acquire("x", "other", 1)
+
+
+def test_check_fails_once_lease_is_taken(tmp_path):
+    state = SQLiteSharedState(str(tmp_path / "state.db"))
+    with pytest.raises(LeaseLost):
+        with state.lease("x", ttl=0.2) as lease:
+            lease.stop() # Προσομοίωση replica που κόλλησε: χωρίς heartbeat
+            time.sleep(0.3)
+            assert state.try_acquire("x", "other", 1)
+            lease.check()
+
+
+def test_incomplete_backend_fails_on_creation():
+    class Partial(SharedState):
+        def try_acquire(self, name, token, ttl): return True
+
+    with pytest.raises(TypeError):
+        Partial()
+
+
+def test_expiry_after_body_is_reported_not_raised(tmp_path):
+    state = SQLiteSharedState(str(tmp_path / "state.db"))
+    with state.lease("x", ttl=0.2) as lease:
+        lease.check()
+        lease.stop() # Η εγγραφή έγινε, μετά κόλλησε το replica
+        time.sleep(0.3)
+    assert lease.expired_at_release
+
+
+def _append_worker(url, iterations):
+    state = open_shared_state(url)
+    for i in range(iterations):
+        state.append_record("logs", {"pid": os.getpid(), "i": i})
+
+
+def test_append_only_records_compact_without_loss(tmp_path):
+    url = f"sqlite:///{tmp_path / 'state.db'}"
+    logs_path = tmp_path / "logs.json"
+    state = open_shared_state(url)
+
+    def load():
+        return json.loads(logs_path.read_text(encoding="utf-8")) if logs_path.exists() else []
+
+    def save(data):
+        logs_path.write_text(json.dumps(data), encoding="utf-8")
+
+    workers = [multiprocessing.Process(target=_append_worker, args=(url, ITERATIONS)) for _ in range(WORKERS)]
+    for w in workers: w.start()
+    state.compact("logs", load, save) # Compact ενώ γράφουν ακόμα οι workers
+    for w in workers: w.join(timeout=120)
+    assert state.compact("logs", load, save)
+
+    logs = load()
+    assert len(logs) == WORKERS * ITERATIONS
+    assert len({e["log_id"] for e in logs}) == WORKERS * ITERATIONS
+    assert state.records("logs") == []
+
+
+def test_compact_skips_records_already_saved(tmp_path):
+    state = SQLiteSharedState(str(tmp_path / "state.db"))
+    state.append_record("logs", {"i": 1})
+    assert not state.compact("logs", lambda: [], lambda data: False) # Αποτυχία save -> δεν σβήνεται τίποτα
+    assert len(state.records("logs")) == 1
+
+    saved = list(state.records("logs")) # Σώθηκε, αλλά το replica έπεσε πριν το trim
+
+    def save(data):
+        saved[:] = data
+
+    assert state.compact("logs", lambda: list(saved), save)
+    assert len(saved) == 1
+    assert state.records("logs") == []